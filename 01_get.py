@@ -3,9 +3,15 @@ import re
 import time
 import logging
 import argparse
+import collections
+import concurrent.futures
+import threading
+from datetime import timezone
+from email.utils import parsedate_to_datetime
 from urllib.parse import urlparse, urljoin
-from curl_cffi import requests
+from curl_cffi import requests, CurlHttpVersion
 from bs4 import BeautifulSoup
+from lxml import etree, html as lxml_html
 from tqdm import tqdm
 
 # --- Configuration ---
@@ -19,8 +25,39 @@ PERMALINKS_FILE = "permalinks.txt"
 SCANNED_FILE = "scanned.txt"
 # The delay in seconds to wait before retrying a failed request.
 RETRY_DELAY = 30
+# The longest a server's Retry-After or rate limit reset can make us wait, in seconds.
+MAX_BACKOFF = 300
 # The browser profile to impersonate to avoid being blocked.
 IMPERSONATE_BROWSER = "chrome110"
+# Use HTTP/2 for HTTPS sites, so requests to the same host can share one
+# connection instead of each opening their own. Plain HTTP stays on HTTP/1.1.
+HTTP_VERSION = CurlHttpVersion.V2TLS
+# How many pages to scan between writes of the progress files.
+FLUSH_EVERY_PAGES = 20
+
+# --- Precompiled Patterns ---
+# Finds the href of every link whose text is exactly "Permalink". Non-breaking
+# spaces are turned into normal spaces first so they get trimmed as well.
+PERMALINK_HREF_XPATH = etree.XPath("//a[@href][normalize-space(translate(., '\u00a0', ' ')) = 'Permalink']/@href")
+# Matches any post path with a /YYYY/MM/ structure, used by the alternative method.
+POST_URL_RE = re.compile(r'/\d{4}/\d{2}/[^/]+\.html')
+# The links inside the pager's right-hand side, where Typepad puts "Next »".
+NEXT_LINK_XPATH = etree.XPath(
+    "//div[contains(concat(' ', normalize-space(@class), ' '), ' pager-inner ')]"
+    "//span[contains(concat(' ', normalize-space(@class), ' '), ' pager-right ')]//a"
+)
+# Pulls the page number out of a pager link such as ".../page/3/".
+PAGE_NUMBER_RE = re.compile(r'/page/(\d+)/?$')
+
+# --- Buffered progress, written to disk by flush_progress() ---
+permalink_buffer = []
+scanned_buffer = []
+
+# --- Per-host backoff ---
+# When a server asks us to slow down, every worker holds off that host until
+# the time stored here (a time.monotonic() value). See note_rate_limit().
+host_resume_times = {}
+host_resume_lock = threading.Lock()
 
 # --- Logging will be configured in main() ---
 
@@ -28,9 +65,43 @@ def setup_environment():
     """
     Creates the necessary directory for storing raw HTML data if it doesn't already exist.
     """
-    if not os.path.exists(DATA_DIR):
+    try:
         os.makedirs(DATA_DIR)
         logging.info(f"Created directory: {DATA_DIR}")
+    except FileExistsError:
+        pass
+
+def drop_torn_last_line(path):
+    """
+    Cuts off a last line that has no newline, which is what a crash in the
+    middle of an append leaves behind. Without this the fragment would be read
+    as an entry and the next append would be glued onto the end of it.
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    with open(path, 'rb+') as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) == b'\n':
+            return
+        # Only a damaged file gets read in full, to find where its last good line ends.
+        f.seek(0)
+        f.truncate(f.read().rfind(b'\n') + 1)
+        logging.warning(f"Dropped an incomplete last line from {path}.")
+
+def end_last_line(path):
+    """
+    Adds the newline missing from the end of a file, so the next append starts
+    on a line of its own. Used for permalinks.txt, which may have been written
+    by hand: its last line is a real URL, not a fragment to throw away. A torn
+    URL from a crash belongs to a page that wasn't marked as scanned yet, so
+    that page is scanned again anyway.
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    with open(path, 'rb+') as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b'\n':
+            f.write(b'\n')
 
 def get_already_scanned_pages():
     """
@@ -39,60 +110,102 @@ def get_already_scanned_pages():
     Returns:
         A set of integers representing the page numbers already scanned.
     """
+    if not os.path.exists(SCANNED_FILE):
+        return set()
+    # Read the whole file at once and split it, so a long log from a big blog
+    # converts in one pass instead of one Python loop iteration per line.
+    with open(SCANNED_FILE, 'r') as f:
+        entries = f.read().split()
+    try:
+        return set(map(int, entries))
+    except ValueError:
+        pass
+    # Some line isn't a number; go through them one by one to report it.
     scanned_pages = set()
-    if os.path.exists(SCANNED_FILE):
-        with open(SCANNED_FILE, 'r') as f:
-            for line in f:
-                # Safely convert each line to an integer.
-                try:
-                    scanned_pages.add(int(line.strip()))
-                except ValueError:
-                    # Use tqdm.write to avoid interfering with a progress bar if this runs mid-script
-                    tqdm.write(f"WARNING: Could not parse line in {SCANNED_FILE}: {line.strip()}")
+    for entry in entries:
+        try:
+            scanned_pages.add(int(entry))
+        except ValueError:
+            # Use tqdm.write to avoid interfering with a progress bar if this runs mid-script
+            tqdm.write(f"WARNING: Could not parse line in {SCANNED_FILE}: {entry}")
     return scanned_pages
 
 def save_permalinks(links):
     """
-    Appends a list of found permalinks to the permalinks.txt file.
+    Queues a list of found permalinks to be appended to the permalinks.txt file
+    the next time flush_progress() is called.
     Args:
         links (list): A list of URL strings to save.
     """
-    with open(PERMALINKS_FILE, 'a', encoding='utf-8') as f:
-        for link in links:
-            f.write(link + '\n')
+    permalink_buffer.extend(links)
 
 def mark_page_as_scanned(page_number):
     """
-    Appends a page number to the scanned.txt file to mark it as complete.
+    Queues a page number to be appended to the scanned.txt file, marking it as
+    complete, the next time flush_progress() is called.
     Args:
         page_number (int): The page number that was successfully processed.
     """
-    with open(SCANNED_FILE, 'a') as f:
-        f.write(str(page_number) + '\n')
+    scanned_buffer.append(page_number)
 
-def extract_permalinks_default(html_content, page_url, blog_name):
+def flush_progress():
+    """
+    Appends all buffered permalinks and scanned page numbers to their files,
+    opening each file once and writing it in a single call. Permalinks are
+    written first so a page is never marked as scanned before its links are saved.
+    """
+    if permalink_buffer:
+        with open(PERMALINKS_FILE, 'a', encoding='utf-8') as f:
+            f.write(''.join(link + '\n' for link in permalink_buffer))
+            # Make sure the links are on disk before their pages are marked as scanned.
+            f.flush()
+            os.fsync(f.fileno())
+        permalink_buffer.clear()
+
+    if scanned_buffer:
+        with open(SCANNED_FILE, 'a') as f:
+            f.write(''.join(str(page_number) + '\n' for page_number in scanned_buffer))
+        scanned_buffer.clear()
+
+def parse_html(html_content):
     """
-    The default method. Uses BeautifulSoup to parse the HTML, find all links
-    with the exact text "Permalink", and returns their href attributes.
+    Parses HTML directly into an lxml tree, skipping BeautifulSoup's Python-side
+    tree building. The text is handed to lxml as UTF-8 bytes so that pages which
+    start with an XML declaration are accepted.
     Args:
         html_content (str): The raw HTML of a webpage.
+    Returns:
+        The root element of the document, or None if the document is empty.
+    """
+    parser = lxml_html.HTMLParser(encoding='utf-8')
+    try:
+        return lxml_html.document_fromstring(html_content.encode('utf-8'), parser=parser)
+    except etree.ParserError:
+        return None
+
+def extract_permalinks_default(root, page_url, blog_name):
+    """
+    The default method. Uses an lxml XPath query to find all links with the
+    exact text "Permalink", and returns their href attributes.
+    Args:
+        root: The page parsed by parse_html(), or None for an empty page.
         page_url (str): The URL of the page being scanned, used to resolve relative links.
         blog_name (str): The name of the blog, used to construct the permalink prefix.
     Returns:
         A set of unique permalink URLs found on the page.
     """
-    soup = BeautifulSoup(html_content, 'html.parser')
     permalinks = set()
+    if root is None:
+        return permalinks
+
     parsed_url = urlparse(page_url)
     permalink_prefix = f"{parsed_url.scheme}://{parsed_url.netloc}/{blog_name}/"
 
-    for link in soup.find_all('a', href=True):
-        if link.get_text(strip=True) == 'Permalink':
-            href = link['href']
-            # Join URL to handle relative links, then check prefix
-            absolute_url = urljoin(page_url, href)
-            if absolute_url.startswith(permalink_prefix):
-                permalinks.add(absolute_url)
+    for href in PERMALINK_HREF_XPATH(root):
+        # Join URL to handle relative links, then check prefix
+        absolute_url = urljoin(page_url, href)
+        if absolute_url.startswith(permalink_prefix):
+            permalinks.add(absolute_url)
 
     return permalinks
 
@@ -108,43 +221,39 @@ def extract_permalinks_alternative(html_content, page_url, blog_name=None):
     Returns:
         A set of unique permalink URLs found on the page.
     """
-    soup = BeautifulSoup(html_content, 'html.parser')
+    soup = BeautifulSoup(html_content, 'lxml')
     permalinks = set()
 
-    # This regex is flexible and looks for any path with a /YYYY/MM/ structure.
-    post_pattern = re.compile(r'/\d{4}/\d{2}/[^/]+\.html')
-
     for link in soup.find_all('a', href=True):
         href = link['href']
         # Search for the pattern in the link
-        if post_pattern.search(href):
+        if POST_URL_RE.search(href):
             # Resolve relative URLs (e.g., "/2024/01/post.html") into full URLs
             absolute_url = urljoin(page_url, href)
             permalinks.add(absolute_url)
 
     return permalinks
 
-def check_for_next_page(html_content, current_page_num):
+def check_for_next_page(root, current_page_num):
     """
-    Parses the HTML to find a valid 'Next' page link.
+    Looks in the parsed page for a valid 'Next' page link.
     A valid link is identified by being in the 'pager-right' section and
     containing either the text 'Next' or the '»' character. It must also
     point to the next sequential page.
     Args:
-        html_content (str): The raw HTML of the current page.
+        root: The page parsed by parse_html(), or None for an empty page.
         current_page_num (int): The number of the page just scraped.
     Returns:
         bool: True if a valid next page exists, False otherwise.
     """
-    soup = BeautifulSoup(html_content, 'html.parser')
-
-    next_link = soup.select_one('div.pager-inner span.pager-right a')
+    next_links = NEXT_LINK_XPATH(root) if root is not None else []
 
-    if not next_link:
+    if not next_links:
         logging.debug("CheckNextPage: Did not find a 'Next' link element using the selector.")
         return False
 
-    link_text = next_link.get_text(strip=True).lower()
+    next_link = next_links[0]
+    link_text = next_link.text_content().strip().lower()
     if 'next' not in link_text and '»' not in link_text:
         logging.debug(f"CheckNextPage: Link text '{link_text}' does not contain 'next' or '»'.")
         return False
@@ -154,7 +263,7 @@ def check_for_next_page(html_content, current_page_num):
         logging.debug("CheckNextPage: 'Next' link found, but it has no href attribute.")
         return False
 
-    match = re.search(r'/page/(\d+)/?$', next_href)
+    match = PAGE_NUMBER_RE.search(next_href)
     if not match:
         logging.debug(f"CheckNextPage: Could not find page number in href '{next_href}'.")
         tqdm.write(f"WARNING: Found 'Next' link with an unexpected URL format: {next_href}")
@@ -178,6 +287,151 @@ def check_for_next_page(html_content, current_page_num):
         tqdm.write(f"WARNING: Could not parse page number from 'Next' link URL: {next_href}")
         return False
 
+def parse_delay_header(value):
+    """
+    Turns a Retry-After or X-RateLimit-Reset header into a number of seconds
+    from now. Accepts a number of seconds, a Unix timestamp or an HTTP date.
+    Returns None if the header is missing or can't be understood.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            when = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=timezone.utc)
+        return max(0.0, when.timestamp() - time.time())
+    # Some servers send the time the limit resets rather than a delay.
+    if seconds > 1e9:
+        seconds -= time.time()
+    return max(0.0, seconds)
+
+def note_rate_limit(url, response, attempt=0):
+    """
+    Checks a response for signs that the server wants us to slow down, and if
+    so holds off every request to its host until it is ready again. 429 and
+    503 responses wait as long as Retry-After says, or back off exponentially
+    when it isn't given. A successful response that reports no requests left
+    (X-RateLimit-Remaining: 0) waits until X-RateLimit-Reset.
+    Returns the number of seconds the host is held off for, or 0.
+    """
+    headers = response.headers
+    if response.status_code in (429, 503):
+        delay = parse_delay_header(headers.get('Retry-After'))
+        if delay is None:
+            delay = RETRY_DELAY * 2 ** attempt
+    elif (headers.get('X-RateLimit-Remaining') or '').strip() == '0':
+        delay = parse_delay_header(headers.get('X-RateLimit-Reset')) or 0
+    else:
+        return 0
+    delay = min(delay, MAX_BACKOFF)
+    if delay > 0:
+        host = urlparse(url).netloc
+        with host_resume_lock:
+            host_resume_times[host] = max(host_resume_times.get(host, 0), time.monotonic() + delay)
+    return delay
+
+def wait_for_host(url):
+    """
+    Blocks until requests to the host of url are allowed again. Returns
+    straight away unless note_rate_limit() has held the host off.
+    """
+    host = urlparse(url).netloc
+    while True:
+        with host_resume_lock:
+            delay = host_resume_times.get(host, 0) - time.monotonic()
+        if delay <= 0:
+            return
+        time.sleep(delay)
+
+def fetch_page(session, url, page_num, auth=None):
+    """
+    Fetches a single blog page, retrying on server errors and exceptions, and
+    backing off when the server says it is being sent too many requests.
+    This runs in a worker thread so that several pages can be downloaded at once.
+    Args:
+        session: The curl_cffi session to make the request with.
+        url (str): The URL of the page to fetch.
+        page_num (int): The number of the page, used for log messages.
+        auth (tuple, optional): A (username, password) tuple for HTTP Basic Authentication.
+    Returns:
+        The page HTML as a string, "STOP" if the page doesn't exist (404),
+        "SKIP" for any other unexpected status, or None if all retries failed.
+    """
+    retries = 0
+    max_retries = 5
+
+    while retries < max_retries:
+        try:
+            wait_for_host(url)
+            logging.debug(f"Requesting URL: {url}")
+            response = session.get(url, impersonate=IMPERSONATE_BROWSER, timeout=20, auth=auth)
+            logging.debug(f"Received status code {response.status_code} for {url}")
+            backoff = note_rate_limit(url, response, retries)
+
+            if response.status_code == 200:
+                return response.text
+            elif response.status_code == 404:
+                return "STOP"
+            elif response.status_code in (429, 503):
+                # wait_for_host() holds off the retry, and the other workers, until the server is ready.
+                tqdm.write(f"WARNING: Server asked us to slow down (status {response.status_code}) on page {page_num}. Retrying in {backoff:.0f}s...")
+                retries += 1
+            elif 500 <= response.status_code < 600:
+                tqdm.write(f"WARNING: Server error (status {response.status_code}) for page {page_num}. Retrying in {RETRY_DELAY}s...")
+                time.sleep(RETRY_DELAY)
+                retries += 1
+            else:
+                tqdm.write(f"ERROR: Unexpected status code {response.status_code} for page {page_num}. Skipping.")
+                return "SKIP"
+
+        except Exception as e:
+            tqdm.write(f"ERROR: Exception on page {page_num}: {e}. Retrying in {RETRY_DELAY}s...")
+            time.sleep(RETRY_DELAY)
+            retries += 1
+
+    tqdm.write(f"ERROR: Failed to fetch page {page_num} after {max_retries} retries. Skipping.")
+    return None
+
+def scan_page(session, url, page_num, blog_name, auth=None):
+    """
+    Fetches a page and extracts everything the main loop needs from it. This
+    runs in a worker thread, so pages are parsed while other pages are still
+    downloading instead of one after another on the main thread.
+    Args:
+        session: The curl_cffi session to make the request with.
+        url (str): The URL of the page to fetch.
+        page_num (int): The number of the page.
+        blog_name (str): The name of the blog.
+        auth (tuple, optional): A (username, password) tuple for HTTP Basic Authentication.
+    Returns:
+        A (content, permalinks, has_next_page) tuple. content is whatever
+        fetch_page() returned; the other two are only set when it is the page HTML.
+    """
+    html_content = fetch_page(session, url, page_num, auth)
+    if html_content in ("STOP", "SKIP") or html_content is None:
+        return html_content, None, False
+
+    # --- Permalink Extraction with Fallback Logic ---
+    # Try the standard method first (looks for "Permalink" text).
+    # The page is parsed once, for both the standard method and the next page check.
+    root = parse_html(html_content)
+    logging.debug(f"Using standard extraction method on page {page_num}.")
+    permalinks = extract_permalinks_default(root, url, blog_name)
+
+    # If the standard method finds nothing, fallback to the alternative method.
+    if not permalinks:
+        logging.debug(f"Standard method found no links. Trying alternative method as a fallback on page {page_num}.")
+        permalinks = extract_permalinks_alternative(html_content, url, blog_name)
+
+    has_next_page = check_for_next_page(root, page_num)
+    return html_content, permalinks, has_next_page
+
 def main():
     """
     The main function to run the scraper.
@@ -190,6 +444,12 @@ def main():
         default=0.5,
         help="The delay in seconds between page requests. Default: 0.5"
     )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=4,
+        help="Number of pages to download at the same time. Default: 4"
+    )
     parser.add_argument(
         "--debug",
         action="store_true",
@@ -224,100 +484,83 @@ def main():
     logging.info(f"Using Blog Name: '{blog_name}'")
 
     setup_environment()
+    end_last_line(PERMALINKS_FILE)
+    drop_torn_last_line(SCANNED_FILE)
     scanned_pages = get_already_scanned_pages()
     logging.info(f"Found {len(scanned_pages)} already scanned pages. Resuming progress.")
 
-    session = requests.Session()
+    session = requests.Session(http_version=HTTP_VERSION)
 
     # Setup authentication if provided
     auth = None
     if args.username and args.password:
         auth = (args.username, args.password)
         logging.info("Using HTTP Basic Authentication")
+
     page_num = START_PAGE
     total_permalinks_found = 0
 
-    with tqdm(unit=" page") as pbar:
-        while True:
-            pbar.set_description(f"Scanning Page {page_num}")
-
-            if page_num in scanned_pages:
-                page_num += 1
-                continue
-
-            url = BASE_URL.format(page_num)
-            retries = 0
-            max_retries = 5
-            response_content = None
-
-            while retries < max_retries:
-                try:
-                    logging.debug(f"Requesting URL: {url}")
-                    response = session.get(url, impersonate=IMPERSONATE_BROWSER, timeout=20, auth=auth)
-                    logging.debug(f"Received status code {response.status_code} for {url}")
-
-                    if response.status_code == 200:
-                        response_content = response.text
-                        break
-                    elif response.status_code == 404:
-                        tqdm.write(f"Page {page_num} not found (404). Assuming this is the end of the blog.")
-                        response_content = "STOP"
-                        break
-                    elif 500 <= response.status_code < 600:
-                        tqdm.write(f"WARNING: Server error (status {response.status_code}) for page {page_num}. Retrying in {RETRY_DELAY}s...")
-                        time.sleep(RETRY_DELAY)
-                        retries += 1
-                    else:
-                        tqdm.write(f"ERROR: Unexpected status code {response.status_code} for page {page_num}. Skipping.")
-                        response_content = "SKIP"
-                        break
-
-                except Exception as e:
-                    tqdm.write(f"ERROR: Exception on page {page_num}: {e}. Retrying in {RETRY_DELAY}s...")
-                    time.sleep(RETRY_DELAY)
-                    retries += 1
-
-            if response_content == "STOP":
-                break
-            if response_content == "SKIP" or response_content is None:
-                if response_content is None:
-                    tqdm.write(f"ERROR: Failed to fetch page {page_num} after {max_retries} retries. Skipping.")
-                page_num += 1
-                continue
-
-            # --- Process successful fetch ---
-            pbar.update(1)
-            file_path = os.path.join(DATA_DIR, f'page_{page_num}.html')
-            with open(file_path, 'w', encoding='utf-8') as f:
-                f.write(response_content)
-
-            # --- Permalink Extraction with Fallback Logic ---
-            # Try the standard method first (looks for "Permalink" text).
-            logging.debug(f"Using standard extraction method on page {page_num}.")
-            permalinks = extract_permalinks_default(response_content, url, blog_name)
-
-            # If the standard method finds nothing, fallback to the alternative method.
-            if not permalinks:
-                logging.debug(f"Standard method found no links. Trying alternative method as a fallback on page {page_num}.")
-                permalinks = extract_permalinks_alternative(response_content, url, blog_name)
-
-            # --- Save found permalinks ---
-            if permalinks:
-                logging.debug(f"Found {len(permalinks)} permalinks on page {page_num}.")
-                save_permalinks(permalinks)
-                total_permalinks_found += len(permalinks)
-            else:
-                logging.debug(f"No permalinks found on page {page_num} using any available method.")
-
-            pbar.set_postfix(found=f"{total_permalinks_found} permalinks")
-            mark_page_as_scanned(page_num)
-
-            if not check_for_next_page(response_content, page_num):
-                tqdm.write(f"No valid 'Next' link found on page {page_num}. Concluding scrape.")
-                break
-
-            page_num += 1
-            time.sleep(args.sleep_time) # A small polite delay between pages
+    try:
+        with tqdm(unit=" page") as pbar, concurrent.futures.ThreadPoolExecutor(max_workers=args.threads) as executor:
+            # A rolling window of page requests is kept in flight. Pages are processed
+            # strictly in order, and a new request is started as each one is consumed,
+            # so the workers never sit idle waiting for a whole batch to finish.
+            pending_pages = collections.deque()
+
+            while True:
+                # --- Top up the window with the next unscanned pages ---
+                # The window holds one page more than there are workers. That page
+                # waits in the executor's queue and starts the moment the page being
+                # consumed finishes, so it downloads while that page is saved and
+                # during the polite delay, even with --threads 1.
+                while len(pending_pages) <= args.threads:
+                    if page_num not in scanned_pages:
+                        future = executor.submit(scan_page, session, BASE_URL.format(page_num), page_num, blog_name, auth)
+                        pending_pages.append((page_num, future))
+                    page_num += 1
+
+                current_page_num, future = pending_pages.popleft()
+                pbar.set_description(f"Scanning Page {current_page_num}")
+                response_content, permalinks, has_next_page = future.result()
+
+                if response_content == "STOP":
+                    tqdm.write(f"Page {current_page_num} not found (404). Assuming this is the end of the blog.")
+                    break
+                if response_content == "SKIP" or response_content is None:
+                    continue
+
+                # --- Process successful fetch ---
+                pbar.update(1)
+                file_path = os.path.join(DATA_DIR, f'page_{current_page_num}.html')
+                with open(file_path, 'w', encoding='utf-8') as f:
+                    f.write(response_content)
+
+                # --- Save found permalinks ---
+                if permalinks:
+                    logging.debug(f"Found {len(permalinks)} permalinks on page {current_page_num}.")
+                    save_permalinks(permalinks)
+                    total_permalinks_found += len(permalinks)
+                else:
+                    logging.debug(f"No permalinks found on page {current_page_num} using any available method.")
+
+                pbar.set_postfix(found=f"{total_permalinks_found} permalinks")
+                mark_page_as_scanned(current_page_num)
+                if len(scanned_buffer) >= FLUSH_EVERY_PAGES:
+                    flush_progress()
+
+                if not has_next_page:
+                    tqdm.write(f"No valid 'Next' link found on page {current_page_num}. Concluding scrape.")
+                    break
+
+                time.sleep(args.sleep_time) # A small polite delay between pages
+
+            # Any pages still in the window are past the end of the blog. Don't start
+            # fetching the ones that are still waiting in the queue.
+            for _, future in pending_pages:
+                future.cancel()
+    finally:
+        # Save whatever progress is still buffered, even if the scrape was interrupted.
+        flush_progress()
 
     logging.info(f"Scraping process complete. Found a total of {total_permalinks_found} permalinks.")
 
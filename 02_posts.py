@@ -2,13 +2,18 @@ import os
 import logging
 import time
 import sys
+import queue
 import threading
 import concurrent.futures
 import argparse
 import re
+import shutil
+from datetime import timezone
+from email.utils import parsedate_to_datetime
 from urllib.parse import urljoin, urlparse
-from curl_cffi import requests
+from curl_cffi import requests, CurlHttpVersion
 from bs4 import BeautifulSoup
+from lxml import etree, html as lxml_html
 from tqdm import tqdm
 
 # --- Configuration ---
@@ -23,33 +28,191 @@ ASSETS_DIR = "posts/assets"
 # Retry logic for fetching files
 MAX_RETRIES = 3
 RETRY_DELAY = 5 # seconds
+# The longest a server's Retry-After or rate limit reset can make us wait, in seconds.
+MAX_BACKOFF = 300
 # The browser profile to impersonate to avoid being blocked.
 IMPERSONATE_BROWSER = "chrome110"
+# Use HTTP/2 for HTTPS sites, so requests to the same host can share one
+# connection instead of each opening their own. Plain HTTP stays on HTTP/1.1.
+HTTP_VERSION = CurlHttpVersion.V2TLS
+# File signatures used to pick an extension when the server doesn't give a
+# usable Content-Type. Keyed by the first three bytes of the file, each entry
+# holds the full signature(s) to confirm and the extension to use.
+FILE_SIGNATURES = {
+    b'\xff\xd8\xff': ((b'\xff\xd8\xff',), '.jpg'),
+    b'\x89PN': ((b'\x89PNG\r\n\x1a\n',), '.png'),
+    b'GIF': ((b'GIF87a', b'GIF89a'), '.gif'),
+}
+
+# --- Precompiled Patterns ---
+# Characters that are not safe to keep in an asset filename.
+UNSAFE_FILENAME_CHARS_RE = re.compile(r'[^\w\-_.]')
+# The target of an @import rule, with or without url(...) around it.
+CSS_IMPORT_RE = re.compile(r'@import\s+(?:url\()?[\'"]?([^\'"\)]+)[\'"]?\)?[^;]*;')
+# The target of any url(...) reference in a stylesheet.
+CSS_URL_RE = re.compile(r'url\([\'"]?([^\'"\)]+)[\'"]?\)')
+# The size suffix Typepad adds to image thumbnails (e.g., "-500wi").
+THUMBNAIL_SUFFIX_RE = re.compile(r'-\d+wi$')
+# The YYYY/MM part of a post path.
+POST_DATE_RE = re.compile(r'/(\d{4})/(\d{2})/')
+# Typepad puts the body of a post in <div class="entry-content">.
+ENTRY_CONTENT_XPATH = etree.XPath("//div[contains(concat(' ', normalize-space(@class), ' '), ' entry-content ')]")
+# The non-empty image sources and link targets of a post body, in document order.
+MEDIA_URL_XPATH = etree.XPath(".//img[@src != '']/@src | .//a[@href != '']/@href")
 
 # Global debug flag
 DEBUG_MODE = False
 
+# --- Per-thread HTTP sessions ---
+# Each worker thread gets its own curl_cffi Session from get_thread_session().
+thread_local = threading.local()
+open_sessions = []
+open_sessions_lock = threading.Lock()
+
+# --- Per-host backoff ---
+# When a server asks us to slow down, every worker holds off that host until
+# the time stored here (a time.monotonic() value). See note_rate_limit().
+host_resume_times = {}
+host_resume_lock = threading.Lock()
+
+# --- Saved assets ---
+# Paths of the shared assets already on disk. Every post links the same
+# stylesheets and scripts, so they are looked up here instead of being
+# checked with os.path.exists() again for each post. Filled by
+# load_saved_assets() and added to as assets are downloaded.
+saved_asset_paths = set()
+
+# --- Media shared between posts ---
+# Every media URL downloaded in this run, so that a file linked from several
+# posts is only downloaded once. A URL maps to its download_media() future while
+# the download runs, and to the saved file's path once it has succeeded; failed
+# downloads are dropped. Finished futures aren't kept, as they hold on to the
+# callbacks of every post that waited on them.
+media_downloads = {}
+media_downloads_lock = threading.RLock()
+
 # --- Setup Logging ---
 # Configures basic logging to print progress and error messages to the console.
 # Set format to a simpler one to avoid clutter with the tqdm bar.
 logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
 
-def debug_print(message):
-    """Print debug messages if debug mode is enabled"""
+def debug_print(message, *args):
+    """
+    Print debug messages if debug mode is enabled. Any args are %-formatted
+    into the message only then, so disabled calls cost no string building.
+    """
     if DEBUG_MODE:
-        tqdm.write(f"DEBUG: {message}")
+        tqdm.write("DEBUG: " + (message % args if args else message))
+
+def get_thread_session():
+    """
+    Returns the calling thread's own curl_cffi Session, creating it on first use.
+    Each session keeps its own connection pool and cookies, so workers reuse
+    their TCP and TLS connections across posts without sharing curl state.
+    """
+    session = getattr(thread_local, 'session', None)
+    if session is None:
+        # The session is only ever used by this thread, so it can own a single
+        # curl handle that close_thread_sessions() can close from the main thread.
+        session = requests.Session(http_version=HTTP_VERSION, use_thread_local_curl=False)
+        thread_local.session = session
+        with open_sessions_lock:
+            open_sessions.append(session)
+    return session
+
+def close_thread_sessions():
+    """
+    Closes every session created by get_thread_session(). Only call this once
+    the worker threads have finished.
+    """
+    with open_sessions_lock:
+        for session in open_sessions:
+            session.close()
+        open_sessions.clear()
+
+def parse_delay_header(value):
+    """
+    Turns a Retry-After or X-RateLimit-Reset header into a number of seconds
+    from now. Accepts a number of seconds, a Unix timestamp or an HTTP date.
+    Returns None if the header is missing or can't be understood.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            when = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=timezone.utc)
+        return max(0.0, when.timestamp() - time.time())
+    # Some servers send the time the limit resets rather than a delay.
+    if seconds > 1e9:
+        seconds -= time.time()
+    return max(0.0, seconds)
+
+def note_rate_limit(url, response, attempt=0):
+    """
+    Checks a response for signs that the server wants us to slow down, and if
+    so holds off every request to its host until it is ready again. 429 and
+    503 responses wait as long as Retry-After says, or back off exponentially
+    when it isn't given. A successful response that reports no requests left
+    (X-RateLimit-Remaining: 0) waits until X-RateLimit-Reset.
+    Returns the number of seconds the host is held off for, or 0.
+    """
+    headers = response.headers
+    if response.status_code in (429, 503):
+        delay = parse_delay_header(headers.get('Retry-After'))
+        if delay is None:
+            delay = RETRY_DELAY * 2 ** attempt
+    elif (headers.get('X-RateLimit-Remaining') or '').strip() == '0':
+        delay = parse_delay_header(headers.get('X-RateLimit-Reset')) or 0
+    else:
+        return 0
+    delay = min(delay, MAX_BACKOFF)
+    if delay > 0:
+        host = urlparse(url).netloc
+        with host_resume_lock:
+            host_resume_times[host] = max(host_resume_times.get(host, 0), time.monotonic() + delay)
+    return delay
+
+def wait_for_host(url):
+    """
+    Blocks until requests to the host of url are allowed again. Returns
+    straight away unless note_rate_limit() has held the host off.
+    """
+    host = urlparse(url).netloc
+    while True:
+        with host_resume_lock:
+            delay = host_resume_times.get(host, 0) - time.monotonic()
+        if delay <= 0:
+            return
+        time.sleep(delay)
 
 def setup_environment():
     """
     Creates the main 'posts' directory and assets subdirectory if they don't already exist.
     """
-    if not os.path.exists(POSTS_DIR):
+    try:
         os.makedirs(POSTS_DIR)
         logging.info(f"Created main directory: {POSTS_DIR}")
+    except FileExistsError:
+        pass
     
-    if not os.path.exists(ASSETS_DIR):
+    try:
         os.makedirs(ASSETS_DIR)
         logging.info(f"Created assets directory: {ASSETS_DIR}")
+    except FileExistsError:
+        pass
+
+def load_saved_assets():
+    """
+    Records the assets already in ASSETS_DIR with a single directory listing.
+    """
+    saved_asset_paths.update(os.path.join(ASSETS_DIR, name) for name in os.listdir(ASSETS_DIR))
 
 def get_asset_filename_from_url(asset_url):
     """
@@ -77,7 +240,7 @@ def get_asset_filename_from_url(asset_url):
         filename = f"{name}_{query_hash}{ext}"
     
     # Clean up the filename
-    filename = re.sub(r'[^\w\-_.]', '_', filename)
+    filename = UNSAFE_FILENAME_CHARS_RE.sub('_', filename)
     
     return filename
 
@@ -86,12 +249,10 @@ def download_and_rewrite_css_imports(session, css_url, css_content, assets_dir,
     Downloads CSS and recursively downloads any @import or url() references.
     Returns modified CSS content with rewritten URLs.
     """
-    debug_print(f"Processing CSS imports and url() references in: {css_url}")
+    debug_print("Processing CSS imports and url() references in: %s", css_url)
     
-    import_pattern = r'@import\s+(?:url\()?[\'"]?([^\'"\)]+)[\'"]?\)?[^;]*;'
-    imports = re.findall(import_pattern, css_content)
-    url_pattern = r'url\([\'"]?([^\'"\)]+)[\'"]?\)'
-    urls = re.findall(url_pattern, css_content)
+    imports = CSS_IMPORT_RE.findall(css_content)
+    urls = CSS_URL_RE.findall(css_content)
     all_assets = set(imports + urls)
     modified_css = css_content
     
@@ -101,10 +262,11 @@ def download_and_rewrite_css_imports(session, css_url, css_content, assets_dir,
             asset_filename = get_asset_filename_from_url(full_asset_url)
             asset_save_path = os.path.join(assets_dir, asset_filename)
             
-            if not os.path.exists(asset_save_path):
+            if asset_save_path not in saved_asset_paths:
                 success = download_file(session, full_asset_url, asset_save_path, auth=auth)
                 if not success:
                     continue
+                saved_asset_paths.add(asset_save_path)
             
             relative_path = f"./{asset_filename}"
             modified_css = re.sub(
@@ -114,7 +276,7 @@ def download_and_rewrite_css_imports(session, css_url, css_content, assets_dir,
                 f'url\\([\'"]?{re.escape(asset_url)}[\'"]?\\)',
                 f'url("{relative_path}")', modified_css)
         except Exception as e:
-            debug_print(f"Error processing CSS asset {asset_url}: {e}")
+            debug_print("Error processing CSS asset %s: %s", asset_url, e)
     
     return modified_css
 
@@ -134,18 +296,21 @@ def download_page_assets(session, html_content, base_url, assets_dir, auth=None)
                 full_url = urljoin(base_url, href)
                 filename = get_asset_filename_from_url(full_url)
                 save_path = os.path.join(assets_dir, filename)
-                if not os.path.exists(save_path):
+                if save_path not in saved_asset_paths:
+                    wait_for_host(full_url)
                     response = session.get(full_url, impersonate=IMPERSONATE_BROWSER, timeout=5, auth=auth)
+                    note_rate_limit(full_url, response)
                     if response.status_code == 200:
                         modified_css = download_and_rewrite_css_imports(
                             session, full_url, response.text, assets_dir, auth)
                         with open(save_path, 'w', encoding='utf-8') as f:
                             f.write(modified_css)
+                        saved_asset_paths.add(save_path)
                         assets_downloaded[href] = filename
                 else:
                     assets_downloaded[href] = filename
             except Exception as e:
-                debug_print(f"Error downloading CSS {href}: {e}")
+                debug_print("Error downloading CSS %s: %s", href, e)
     
     js_scripts = soup.find_all('script', src=True)
     for js_script in js_scripts:
@@ -155,13 +320,14 @@ def download_page_assets(session, html_content, base_url, assets_dir, auth=None)
                 full_url = urljoin(base_url, src)
                 filename = get_asset_filename_from_url(full_url)
                 save_path = os.path.join(assets_dir, filename)
-                if not os.path.exists(save_path):
+                if save_path not in saved_asset_paths:
                     if download_file(session, full_url, save_path, auth=auth):
+                        saved_asset_paths.add(save_path)
                         assets_downloaded[src] = filename
                 else:
                     assets_downloaded[src] = filename
             except Exception as e:
-                debug_print(f"Error downloading JS {src}: {e}")
+                debug_print("Error downloading JS %s: %s", src, e)
 
     icon_links = soup.find_all('link', rel=['icon', 'shortcut icon', 'apple-touch-icon'])
     for icon_link in icon_links:
@@ -171,13 +337,14 @@ def download_page_assets(session, html_content, base_url, assets_dir, auth=None)
                 full_url = urljoin(base_url, href)
                 filename = get_asset_filename_from_url(full_url)
                 save_path = os.path.join(assets_dir, filename)
-                if not os.path.exists(save_path):
+                if save_path not in saved_asset_paths:
                     if download_file(session, full_url, save_path, auth=auth):
+                        saved_asset_paths.add(save_path)
                         assets_downloaded[href] = filename
                 else:
                     assets_downloaded[href] = filename
             except Exception as e:
-                debug_print(f"Error downloading icon {href}: {e}")
+                debug_print("Error downloading icon %s: %s", href, e)
     
     for original_url, local_filename in assets_downloaded.items():
         relative_path = f"assets/{local_filename}"
@@ -192,23 +359,61 @@ def get_post_urls():
     if not os.path.exists(PERMALINKS_FILE):
         logging.error(f"Error: The file '{PERMALINKS_FILE}' was not found.")
         return []
+    # One read and split; blank lines and surrounding whitespace drop out.
     with open(PERMALINKS_FILE, 'r') as f:
-        return [line.strip() for line in f if line.strip()]
+        return f.read().split()
+
+def drop_torn_last_line(path):
+    """
+    Cuts off a last line that has no newline, which is what a crash in the
+    middle of an append leaves behind. Without this the fragment would be read
+    as an entry and the next append would be glued onto the end of it.
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    with open(path, 'rb+') as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) == b'\n':
+            return
+        # Only a damaged file gets read in full, to find where its last good line ends.
+        f.seek(0)
+        f.truncate(f.read().rfind(b'\n') + 1)
+        logging.warning(f"Dropped an incomplete last line from {path}.")
 
 def get_already_downloaded_urls():
-    downloaded = set()
-    if os.path.exists(DOWNLOADED_LOG_FILE):
-        with open(DOWNLOADED_LOG_FILE, 'r') as f:
-            for line in f:
-                downloaded.add(line.strip())
-    return downloaded
-
-def log_url_as_downloaded(url, lock):
-    with lock:
-        with open(DOWNLOADED_LOG_FILE, 'a') as f:
-            f.write(url + '\n')
+    if not os.path.exists(DOWNLOADED_LOG_FILE):
+        return set()
+    # One read and split instead of a Python loop over every logged URL.
+    with open(DOWNLOADED_LOG_FILE, 'r') as f:
+        return set(f.read().split())
 
-def generate_filename_from_url(url, blog_base_url, post_index):
+def log_url_as_downloaded(url, log_queue):
+    """
+    Hands a finished post's URL to the download log writer thread.
+    """
+    log_queue.put(url)
+
+def write_download_log(log_queue, log_file):
+    """
+    Runs on its own thread and appends the URLs from log_queue to the download
+    log. Whatever has queued up is written and flushed in one go, so workers
+    never wait on the file. A None on the queue stops the thread once
+    everything queued before it has been written.
+    """
+    while True:
+        urls = [log_queue.get()]
+        while True:
+            try:
+                urls.append(log_queue.get_nowait())
+            except queue.Empty:
+                break
+        stop = None in urls
+        log_file.write(''.join(url + '\n' for url in urls if url is not None))
+        log_file.flush()
+        if stop:
+            return
+
+def generate_filename_from_url(url, post_index):
     """
     Generates a filename from a URL. It tries to find a YYYY/MM date in the
     path and uses a sequential index to create a YYYY_MM_####_slug.html filename.
@@ -216,7 +421,7 @@ def generate_filename_from_url(url, blog_base_url, post_index):
     parsed_url = urlparse(url)
     path = parsed_url.path
     slug = os.path.splitext(os.path.basename(path))[0]
-    date_match = re.search(r'/(\d{4})/(\d{2})/', path)
+    date_match = POST_DATE_RE.search(path)
 
     # Convert the index to a zero-padded string (e.g., 9 becomes "0009")
     # Using 4 digits allows for up to 9,999 posts.
@@ -242,39 +447,69 @@ def get_file_extension_from_content_type(content_type):
 
 def detect_file_extension_from_content(content):
     if not content or len(content) < 8: return None
-    if content.startswith(b'\xff\xd8\xff'): return '.jpg'
-    if content.startswith(b'\x89PNG\r\n\x1a\n'): return '.png'
-    if content.startswith(b'GIF87a') or content.startswith(b'GIF89a'): return '.gif'
+    signatures = FILE_SIGNATURES.get(content[:3])
+    if signatures and content.startswith(signatures[0]): return signatures[1]
     if content.startswith(b'RIFF') and b'WEBP' in content[:12]: return '.webp'
     return None
 
+def save_streamed_response(response, save_path, extension=None):
+    """
+    Writes a streamed response to disk chunk by chunk, so large files are never
+    held in memory all at once. If the extension isn't known yet, it is detected
+    from the first bytes of the file. The data is written to a '.part' file that
+    is only renamed into place once the download has completed.
+    """
+    chunks = response.iter_content()
+
+    # Collect enough bytes to recognise the file type from its signature.
+    head = b''
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= 12:
+            break
+
+    if not extension:
+        extension = detect_file_extension_from_content(head)
+    final_save_path = save_path
+    if extension and not os.path.splitext(save_path)[1]:
+        final_save_path = save_path + extension
+
+    part_path = final_save_path + '.part'
+    try:
+        with open(part_path, 'wb') as f:
+            f.write(head)
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(part_path, final_save_path)
+        return final_save_path
+    except BaseException:
+        # Don't leave a half-written file behind to be mistaken for a finished one.
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+
 def download_file(session, url, save_path, fail_fast_on_500=False, auth=None):
     for attempt in range(MAX_RETRIES):
+        backoff = 0
         try:
-            extension = None
+            wait_for_host(url)
+            response = session.get(url, impersonate=IMPERSONATE_BROWSER, timeout=5, auth=auth, stream=True)
+            # A fail-fast probe falls back to the next URL straight away, so a
+            # bare 503 there isn't taken as a request to hold off the whole host.
+            if fail_fast_on_500 and response.status_code == 503 and not response.headers.get('Retry-After'):
+                backoff = 0
+            else:
+                backoff = note_rate_limit(url, response, attempt)
             try:
-                head_response = session.head(url, impersonate=IMPERSONATE_BROWSER, timeout=5, auth=auth)
-                if head_response.status_code == 200:
-                    content_type = head_response.headers.get('Content-Type', '')
-                    extension = get_file_extension_from_content_type(content_type)
-                elif head_response.status_code == 404:
-                    return False
-            except Exception:
-                pass
-            
-            response = session.get(url, impersonate=IMPERSONATE_BROWSER, timeout=5, auth=auth)
-            if response.status_code == 200:
-                if not extension:
-                    extension = detect_file_extension_from_content(response.content)
-                final_save_path = save_path
-                if extension and not os.path.splitext(save_path)[1]:
-                    final_save_path = save_path + extension
-                with open(final_save_path, 'wb') as f:
-                    f.write(response.content)
-                return True
+                if response.status_code == 200:
+                    # The GET's own Content-Type gives the extension, so no separate HEAD is needed.
+                    extension = get_file_extension_from_content_type(response.headers.get('Content-Type', ''))
+                    return save_streamed_response(response, save_path, extension)
+            finally:
+                response.close()
 
             if response.status_code >= 500 and response.status_code < 600 and fail_fast_on_500:
-                debug_print(f"Got status {response.status_code} for {url}. Failing fast to try fallback.")
+                debug_print("Got status %s for %s. Failing fast to try fallback.", response.status_code, url)
                 return False
             elif response.status_code == 404:
                 return False
@@ -285,24 +520,71 @@ def download_file(session, url, save_path, fail_fast_on_500=False, auth=None):
             if DEBUG_MODE:
                 tqdm.write(f"WARNING: Exception for {url} on attempt {attempt + 1}: {e}. Retrying...")
         
-        if attempt < MAX_RETRIES - 1:
+        # When the server asked us to back off, wait_for_host() does the waiting.
+        if attempt < MAX_RETRIES - 1 and not backoff:
             time.sleep(RETRY_DELAY)
     
     tqdm.write(f"ERROR: Failed to download {url} after {MAX_RETRIES} attempts.")
     return False
 
-def process_url(post_index, url, blog_base_url, blog_name, session, lock, sleep_time, auth=None):
+def download_media(urls_to_try, save_path, auth=None):
+    """
+    Downloads a single media file. If there is more than one URL to try, the
+    first (e.g. the full-size version of a thumbnail) is tried with fail-fast
+    on server errors before falling back to the last. Runs on the media pool,
+    so it uses that thread's own session. Returns the saved file's path on
+    success, or False.
+    """
+    session = get_thread_session()
+    success = False
+    if len(urls_to_try) > 1:
+        success = download_file(session, urls_to_try[0], save_path, fail_fast_on_500=True, auth=auth)
+
+    if not success:
+        success = download_file(session, urls_to_try[-1], save_path, auth=auth)
+    return success
+
+def parse_html(html_content):
+    """
+    Parses HTML directly into an lxml tree, skipping BeautifulSoup's Python-side
+    tree building. The text is handed to lxml as UTF-8 bytes so that pages which
+    start with an XML declaration are accepted.
+    Returns the root element, or None if the document is empty.
+    """
+    parser = lxml_html.HTMLParser(encoding='utf-8')
+    try:
+        return lxml_html.document_fromstring(html_content.encode('utf-8'), parser=parser)
+    except etree.ParserError:
+        return None
+
+def find_content_container(root):
+    """
+    Returns the element holding the post itself: the entry-content div if there
+    is one, otherwise the first <article>, otherwise <body>.
+    """
+    entry_content = ENTRY_CONTENT_XPATH(root)
+    if entry_content:
+        return entry_content[0]
+    article = root.find('.//article')
+    if article is not None:
+        return article
+    return root.find('.//body')
+
+def process_url(post_index, url, blog_domain, blog_name, log_queue, sleep_time, media_executor, auth=None):
+    session = get_thread_session()
     stats = {"posts_processed": 0, "media_downloaded": 0, "media_failed": 0}
-    blog_domain = urlparse(blog_base_url).netloc
     
-    base_filename = generate_filename_from_url(url, blog_base_url, post_index)
+    base_filename = generate_filename_from_url(url, post_index)
     html_filename = os.path.splitext(base_filename)[0] + ".html"
     html_save_path = os.path.join(POSTS_DIR, html_filename)
 
     html_content = None
     for attempt in range(MAX_RETRIES):
+        backoff = 0
         try:
+            wait_for_host(url)
             response = session.get(url, impersonate=IMPERSONATE_BROWSER, timeout=5, auth=auth)
+            backoff = note_rate_limit(url, response, attempt)
             if response.status_code == 200:
                 html_content = response.text
                 break
@@ -315,7 +597,8 @@ def process_url(post_index, url, blog_base_url, blog_name, session, lock, sleep_
         except Exception as e:
             if DEBUG_MODE:
                 tqdm.write(f"WARNING: Exception for {url} on attempt {attempt + 1}: {e}. Retrying...")
-        if attempt < MAX_RETRIES - 1:
+        # When the server asked us to back off, wait_for_host() does the waiting.
+        if attempt < MAX_RETRIES - 1 and not backoff:
             time.sleep(RETRY_DELAY)
 
     if html_content is None:
@@ -324,42 +607,40 @@ def process_url(post_index, url, blog_base_url, blog_name, session, lock, sleep_
     
     stats["posts_processed"] = 1
     
-    with open(html_save_path, 'w', encoding='utf-8') as f:
-        f.write(html_content)
     try:
         modified_html = download_page_assets(session, html_content, url, ASSETS_DIR, auth)
-        with open(html_save_path, 'w', encoding='utf-8') as f:
-            f.write(modified_html)
     except Exception:
         modified_html = html_content
 
-    soup = BeautifulSoup(modified_html, 'html.parser')
-    content_div = soup.find('div', class_='entry-content') or soup.find('article') or soup.find('body')
+    # Only the <img> and <a> tags of the post body are needed here, so the page
+    # goes straight into lxml rather than through a BeautifulSoup tree.
+    root = parse_html(modified_html)
+    content_div = find_content_container(root) if root is not None else None
 
-    if content_div:
+    # The post's media files are downloaded in parallel on the shared media pool.
+    media_futures = {}
+    if content_div is not None:
         media_dir_name = os.path.splitext(base_filename)[0]
         media_dir_path = os.path.join(POSTS_DIR, media_dir_name)
-        
-        all_media_tags = content_div.find_all(['img', 'a'])
-        if any(tag.get('src') or '.typepad.com/.a/' in tag.get('href', '') for tag in all_media_tags):
-             if not os.path.exists(media_dir_path):
-                os.makedirs(media_dir_path)
 
-        for i, tag in enumerate(all_media_tags):
-            is_image = tag.name == 'img'
-            url_attr = 'src' if is_image else 'href'
-            link = tag.get(url_attr, '')
-
-            if not link:
-                continue
-            
+        # Files already in the media folder, listed once rather than checked one by
+        # one. Each file scheduled below is added too, so a file linked more than
+        # once in the post is only downloaded once.
+        media_dir_exists = os.path.isdir(media_dir_path)
+        known_filenames = set(os.listdir(media_dir_path)) if media_dir_exists else set()
+
+        for i, link in enumerate(MEDIA_URL_XPATH(content_div)):
+            is_image = link.attrname == 'src'
+            # XPath results keep their element, and with it the whole parsed page,
+            # alive. A plain str lets the page be freed once the post is handled.
+            link = str(link)
             original_full_url = urljoin(url, link)
 
             # --- MODIFIED LOGIC ---
             if is_image:
                 # For images, only download if they are from the same domain as the blog
                 if blog_domain not in original_full_url:
-                    debug_print(f"Skipping external image: {original_full_url}")
+                    debug_print("Skipping external image: %s", original_full_url)
                     continue
             else: # This is an <a> tag
                 is_typepad_media_link = '.typepad.com/.a/' in original_full_url
@@ -367,7 +648,7 @@ def process_url(post_index, url, blog_base_url, blog_name, session, lock, sleep_
                 
                 # A link is a candidate if it's a special media link OR a direct file on our specific blog
                 if not (is_typepad_media_link or is_direct_file_on_domain):
-                    debug_print(f"Skipping external or irrelevant link: {original_full_url}")
+                    debug_print("Skipping external or irrelevant link: %s", original_full_url)
                     continue
 
                 # Now, block links that are just other web pages
@@ -379,45 +660,215 @@ def process_url(post_index, url, blog_base_url, blog_name, session, lock, sleep_
             media_filename = os.path.basename(urlparse(original_full_url).path)
             if not media_filename: media_filename = f"media_{i}"
             
-            media_save_path = os.path.join(media_dir_path, media_filename)
-            if os.path.exists(media_save_path):
+            # Skip files that already exist or are already being downloaded for this post.
+            if media_filename in known_filenames:
                 continue
+            known_filenames.add(media_filename)
+            media_save_path = os.path.join(media_dir_path, media_filename)
 
             urls_to_try = []
             if is_image and '.typepad.com/' in link:
-                cleaned_link = re.sub(r'-\d+wi$', '', link)
+                cleaned_link = THUMBNAIL_SUFFIX_RE.sub('', link)
                 cleaned_full_url = urljoin(url, cleaned_link)
                 if cleaned_full_url != original_full_url:
                     urls_to_try.append(cleaned_full_url)
             urls_to_try.append(original_full_url)
 
-            success = False
-            if len(urls_to_try) > 1:
-                success = download_file(session, urls_to_try[0], media_save_path, fail_fast_on_500=True, auth=auth)
-
-            if not success:
-                success = download_file(session, urls_to_try[-1], media_save_path, auth=auth)
-            
-            if success:
-                stats["media_downloaded"] += 1
-            else:
-                stats["media_failed"] += 1
-                tqdm.write(f"ERROR: All download attempts failed for media: {link}")
-    
-    log_url_as_downloaded(url, lock)
+            # The folder is only created once the post has a file to save in it.
+            if not media_dir_exists:
+                os.makedirs(media_dir_path, exist_ok=True)
+                media_dir_exists = True
+
+            # A file already downloaded, or being downloaded, for another post is
+            # not fetched again; this post gets its own copy of it instead.
+            with media_downloads_lock:
+                earlier = media_downloads.get(original_full_url)
+                if earlier is None:
+                    future = schedule_media_download(original_full_url, urls_to_try, media_save_path, media_executor, auth)
+            if earlier is not None:
+                debug_print("Reusing media downloaded for another post: %s", original_full_url)
+                future = reuse_earlier_media(earlier, original_full_url, urls_to_try, media_save_path, media_executor, auth)
+            media_futures[future] = link
+
+    if media_futures:
+        # The media downloads carry on without this worker, which is free to
+        # start on the next post. The post is saved once the last one finishes.
+        result = track_post_media(media_futures, stats, url, html_save_path, modified_html, log_queue)
+    else:
+        save_post(url, html_save_path, modified_html, log_queue)
+        result = stats
     
-    # Sleep AFTER all work for this URL is done.
+    # Sleep before this worker moves on to the next post.
     if sleep_time > 0:
         time.sleep(sleep_time)
         
-    return stats
+    return result
+
+def save_post(url, html_save_path, html_content, log_queue):
+    """
+    Writes a finished post's HTML file and logs the post as downloaded. The HTML
+    is written once, and last, so a post's HTML file only exists once its assets
+    and media have been handled. main() relies on this to skip posts that
+    finished without making it into the download log.
+    """
+    with open(html_save_path, 'w', encoding='utf-8') as f:
+        f.write(html_content)
+    log_url_as_downloaded(url, log_queue)
+
+def media_download_succeeded(future):
+    """
+    Returns True if a finished download_media() future saved its file.
+    """
+    return not future.cancelled() and future.exception() is None and bool(future.result())
+
+def link_or_copy(source_path, target_path):
+    """
+    Hard-links a file to a second path, falling back to a copy where the
+    filesystem doesn't support links. Returns the target path.
+    """
+    try:
+        os.link(source_path, target_path)
+    except FileExistsError:
+        pass
+    except OSError:
+        shutil.copy2(source_path, target_path)
+    return target_path
+
+def schedule_media_download(media_url, urls_to_try, save_path, media_executor, auth=None):
+    """
+    Submits a download_media() job and records it in media_downloads. When it
+    finishes, the entry is replaced by the saved path, or removed on failure.
+    Returns the job's Future. Must be called with media_downloads_lock held.
+    """
+    def download_finished(future):
+        with media_downloads_lock:
+            if media_downloads.get(media_url) is not future:
+                return
+            if media_download_succeeded(future):
+                media_downloads[media_url] = future.result()
+            else:
+                del media_downloads[media_url]
+
+    future = media_executor.submit(download_media, urls_to_try, save_path, auth)
+    media_downloads[media_url] = future
+    future.add_done_callback(download_finished)
+    return future
+
+def reuse_earlier_media(earlier, media_url, urls_to_try, save_path, media_executor, auth=None):
+    """
+    Gives a post its own copy of a media file that another post downloaded, or
+    is still downloading. earlier is the media_downloads entry: the saved path,
+    or the running download's Future. When the download succeeds, the file is
+    linked into this post's folder under the same name, so
+    04_create_wordpress_file.py finds it at its exact path. When it fails, this
+    post downloads the file itself, unless another post already started doing
+    so. Returns a Future that resolves like a download_media() job.
+    """
+    reused = concurrent.futures.Future()
+
+    def wait_for(entry):
+        if isinstance(entry, str):
+            link_earlier_file(entry)
+        else:
+            entry.add_done_callback(earlier_finished)
+
+    def link_earlier_file(source_path):
+        target_path = os.path.join(os.path.dirname(save_path), os.path.basename(source_path))
+        try:
+            reused.set_result(link_or_copy(source_path, target_path))
+        except Exception as exc:
+            reused.set_exception(exc)
+
+    def own_download_finished(future):
+        if future.cancelled():
+            reused.cancel()
+            reused.set_running_or_notify_cancel()
+        elif future.exception() is not None:
+            reused.set_exception(future.exception())
+        else:
+            reused.set_result(future.result())
+
+    def earlier_finished(future):
+        if media_download_succeeded(future):
+            link_earlier_file(future.result())
+            return
+        try:
+            with media_downloads_lock:
+                newer = media_downloads.get(media_url)
+                if newer is None or newer is future:
+                    retry = schedule_media_download(media_url, urls_to_try, save_path, media_executor, auth)
+                    newer = None
+        except Exception as exc:
+            reused.set_exception(exc)
+            return
+        if newer is None:
+            retry.add_done_callback(own_download_finished)
+        else:
+            wait_for(newer)
+
+    wait_for(earlier)
+    return reused
+
+def track_post_media(media_futures, stats, url, html_save_path, html_content, log_queue):
+    """
+    Counts a post's media downloads as they finish, and saves the post with
+    save_post() when the last one is done. Returns a Future that resolves to
+    the post's stats at that point, for main() to wait on.
+    """
+    post_done = concurrent.futures.Future()
+    lock = threading.Lock()
+    remaining = [len(media_futures)]
+
+    def media_finished(future):
+        # Runs on the media thread that completed the download.
+        with lock:
+            if media_download_succeeded(future):
+                stats["media_downloaded"] += 1
+            else:
+                stats["media_failed"] += 1
+                tqdm.write(f"ERROR: All download attempts failed for media: {media_futures[future]}")
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        try:
+            save_post(url, html_save_path, html_content, log_queue)
+        except Exception as exc:
+            post_done.set_exception(exc)
+            return
+        post_done.set_result(stats)
+
+    for future in list(media_futures):
+        future.add_done_callback(media_finished)
+    return post_done
+
+def collect_results(done_futures, future_to_url, total_stats, pbar):
+    """
+    Adds the stats from finished posts to the running totals, removes them
+    from the in-flight map and advances the progress bar. A post whose media is
+    still downloading returns a Future instead of its stats; that Future takes
+    its place in the in-flight map until the media is done.
+    """
+    for future in done_futures:
+        url = future_to_url.pop(future)
+        try:
+            result = future.result()
+            if isinstance(result, concurrent.futures.Future):
+                future_to_url[result] = url
+                continue
+            if result:
+                for key in total_stats:
+                    total_stats[key] += result.get(key, 0)
+        except Exception as exc:
+            tqdm.write(f"ERROR: {url} generated an exception: {exc}")
+        pbar.update(1)
 
 def main():
     global DEBUG_MODE
     parser = argparse.ArgumentParser(description="Download all posts and their media from a Typepad-style blog.")
     parser.add_argument("blog_url", help="The root URL of the blog (e.g., 'https://growabrain.typepad.com/growabrain/')")
     parser.add_argument("--threads", type=int, default=4, help="Number of concurrent download threads (default: 4).")
-    parser.add_argument("--sleep-time", type=float, default=0.5, help="Seconds for a worker to sleep after finishing a post (default: 0.5).")
+    parser.add_argument("--media-threads", type=int, default=4, help="Number of media files to download at the same time, shared by all posts (default: 4).")
+    parser.add_argument("--sleep-time", type=float, default=0.5, help="Seconds for a worker to sleep after fetching a post and scheduling its media, before it starts the next post (default: 0.5).")
     parser.add_argument("--debug", action="store_true", help="Enable debug output.")
     parser.add_argument("--username", help="Username for HTTP Basic Authentication (if required)")
     parser.add_argument("--password", help="Password for HTTP Basic Authentication (if required)")
@@ -435,20 +886,18 @@ def main():
     logging.info(f"Using Blog Base URL: {BLOG_BASE_URL}")
 
     setup_environment()
+    load_saved_assets()
     all_post_urls_raw = get_post_urls()
 
     # --- Deduplicate URLs while preserving order ---
-    seen_urls = set()
-    unique_ordered_urls = []
-    for url in all_post_urls_raw:
-        if url not in seen_urls:
-            seen_urls.add(url)
-            unique_ordered_urls.append(url)
+    # dict keys keep their first insertion order.
+    unique_ordered_urls = list(dict.fromkeys(all_post_urls_raw))
     
     total_unique_urls = len(unique_ordered_urls)
     logging.info(f"Found {len(all_post_urls_raw)} total URLs in permalinks.txt, with {total_unique_urls} unique URLs.")
     # --- End Deduplication ---
 
+    drop_torn_last_line(DOWNLOADED_LOG_FILE)
     downloaded_urls = get_already_downloaded_urls()
     
     # Create a dictionary of URLs to process with their original index from the unique list
@@ -456,15 +905,35 @@ def main():
         url: i for i, url in enumerate(unique_ordered_urls) if url not in downloaded_urls
     }
     
+    # A post whose HTML file exists finished on an earlier run even if the log
+    # missed it, e.g. after a crash. One directory listing finds them all; they
+    # are added to the log and skipped.
+    existing_html_files = {entry.name for entry in os.scandir(POSTS_DIR) if entry.is_file() and entry.name.endswith('.html')}
+    already_saved_urls = [
+        url for url, i in urls_to_process_with_index.items()
+        if os.path.splitext(generate_filename_from_url(url, i))[0] + ".html" in existing_html_files
+    ]
+    if already_saved_urls:
+        logging.info(f"{len(already_saved_urls)} posts were already saved but missing from {DOWNLOADED_LOG_FILE}. Adding them.")
+        with open(DOWNLOADED_LOG_FILE, 'a') as f:
+            f.write(''.join(url + '\n' for url in already_saved_urls))
+        for url in already_saved_urls:
+            del urls_to_process_with_index[url]
+        downloaded_urls.update(already_saved_urls)
+
     if not urls_to_process_with_index:
         logging.info("All posts have already been downloaded. Exiting.")
         return
 
     logging.info(f"{len(downloaded_urls)} posts already downloaded.")
-    logging.info(f"Starting download of {len(urls_to_process_with_index)} new posts using {args.threads} workers.")
+    logging.info(f"Starting download of {len(urls_to_process_with_index)} new posts using {args.threads} workers and {args.media_threads} media download threads.")
     
-    session = requests.Session()
-    file_lock = threading.Lock()
+    # Keep the download log open for the whole run instead of reopening it for
+    # every post. A single writer thread owns it, so workers just queue the URL.
+    downloaded_log = open(DOWNLOADED_LOG_FILE, 'a')
+    log_queue = queue.Queue()
+    log_writer = threading.Thread(target=write_download_log, args=(log_queue, downloaded_log), daemon=True)
+    log_writer.start()
 
     # Setup authentication if provided
     auth = None
@@ -475,24 +944,31 @@ def main():
     total_stats = {"posts_processed": 0, "media_downloaded": 0, "media_failed": 0}
 
     try:
-        with concurrent.futures.ThreadPoolExecutor(max_workers=args.threads) as executor:
-            # Submit all tasks to the executor at once.
-            future_to_url = {
-                executor.submit(process_url, i, url, BLOG_BASE_URL, blog_name, session, file_lock, args.sleep_time, auth): url
-                for url, i in urls_to_process_with_index.items()
-            }
-            
-            # Process results as they are completed and show progress.
-            completed_iterator = concurrent.futures.as_completed(future_to_url)
-            for future in tqdm(completed_iterator, total=len(future_to_url), desc="Downloading Posts"):
-                try:
-                    result = future.result()
-                    if result:
-                        for key in total_stats:
-                            total_stats[key] += result.get(key, 0)
-                except Exception as exc:
-                    url = future_to_url[future]
-                    tqdm.write(f"ERROR: {url} generated an exception: {exc}")
+        # The media pool is entered first so that it is shut down last, after
+        # the post workers that submit to it have finished.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.media_threads) as media_executor, \
+                concurrent.futures.ThreadPoolExecutor(max_workers=args.threads) as executor, \
+                tqdm(total=len(urls_to_process_with_index), desc="Downloading Posts") as pbar:
+            # Keep only a couple of posts per worker queued at a time instead of
+            # submitting every post up front. This bounds the number of pending
+            # futures on very large blogs without ever leaving a worker idle.
+            # Posts whose media is still downloading count too, with room for
+            # about one per media thread, so slow media holds back new posts
+            # instead of piling up.
+            max_in_flight = args.threads * 2 + args.media_threads
+            future_to_url = {}
+
+            for url, i in urls_to_process_with_index.items():
+                while len(future_to_url) >= max_in_flight:
+                    done, _ = concurrent.futures.wait(future_to_url, return_when=concurrent.futures.FIRST_COMPLETED)
+                    collect_results(done, future_to_url, total_stats, pbar)
+                future = executor.submit(process_url, i, url, parsed_url.netloc, blog_name, log_queue, args.sleep_time, media_executor, auth)
+                future_to_url[future] = url
+
+            # Process the remaining results as they are completed.
+            while future_to_url:
+                done, _ = concurrent.futures.wait(future_to_url, return_when=concurrent.futures.FIRST_COMPLETED)
+                collect_results(done, future_to_url, total_stats, pbar)
         
         logging.info("--- All posts processed successfully. ---")
 
@@ -500,6 +976,10 @@ def main():
         tqdm.write("\nProcess interrupted by user. Exiting.")
         sys.exit(0)
     finally:
+        close_thread_sessions()
+        log_queue.put(None)
+        log_writer.join()
+        downloaded_log.close()
         logging.info("--- Script finished. ---")
         print("\n--- Download Summary ---")
         print(f"✅ Posts processed: {total_stats['posts_processed']}")
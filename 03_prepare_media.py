@@ -49,9 +49,11 @@ def main():
     logging.info("Starting media processing script.")
     
     media_output_path = os.path.join(OUTPUT_DIR, MEDIA_SUBDIR)
-    if not os.path.exists(media_output_path):
+    try:
         os.makedirs(media_output_path)
         logging.info(f"Created output directory: {media_output_path}")
+    except FileExistsError:
+        pass
 
     if not os.path.exists(SOURCE_DIR):
         logging.error(f"Source directory '{SOURCE_DIR}' not found. Please run the download script first.")
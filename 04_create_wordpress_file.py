@@ -28,6 +28,18 @@ OUTPUT_WXR_FILE = os.path.join(SOURCE_EXPORT_DIR, "import.xml")
 WP_MEDIA_PATH = "/wp-content/uploads/typepad_media/"
 # Default author name if one cannot be found in the HTML.
 DEFAULT_AUTHOR = "admin"
+# Phrases that together identify the "Editor's Note" paragraph added to old posts.
+EDITOR_NOTE_PHRASES = ["Back in March", "none of the images will work", "a lot of links are now broken"]
+# Extensions of links on the blog that point to media files rather than to other posts.
+MEDIA_LINK_EXTENSIONS = frozenset(['.jpg', '.jpeg', '.png', '.gif', '.webp', '.pdf', '.zip', '.doc', '.docx', '.mp3'])
+
+# --- Precompiled Patterns ---
+# Matches text containing every editor's note phrase, in any order, in a single scan.
+EDITOR_NOTE_RE = re.compile(''.join(f'(?=.*{re.escape(phrase)})' for phrase in EDITOR_NOTE_PHRASES), re.DOTALL)
+# Paragraphs shorter than the longest phrase can't be an editor's note, so they skip the regex.
+EDITOR_NOTE_MIN_LENGTH = max(len(phrase) for phrase in EDITOR_NOTE_PHRASES)
+# Matches the class Typepad puts on the author block (e.g., "entry-author-jane").
+AUTHOR_CLASS_RE = re.compile(r'^entry-author-')
 
 # --- Setup Logging ---
 logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
@@ -126,88 +138,122 @@ def find_file_in_map(original_url, local_file_slug, stem_map, basename_map):
     # 2. Fallback to just the filename stem
     return basename_map.get(original_filename_no_ext)
 
+def remove_editor_note(p_tag):
+    """
+    Removes the "Editor's Note" paragraph that was added to old posts.
+    """
+    p_text = p_tag.get_text()
+    if len(p_text) >= EDITOR_NOTE_MIN_LENGTH and EDITOR_NOTE_RE.match(p_text):
+        p_tag.decompose()
+
+def process_link_tag(a_tag, stem_map, basename_map, local_file_slug, blog_url, scrub_popups=True):
+    """
+    Scrubs popup links and rewrites links to other posts and to media files.
+    """
+    if not a_tag.parent:
+        return
+
+    original_href = a_tag.get('href', '')
+    # Rule 1: Scrub JavaScript Popups
+    if scrub_popups:
+        onclick = a_tag.get('onclick', '')
+        is_known_popup_url = '.shared/image.html' in original_href or original_href.endswith('-popup')
+        is_generic_js_popup = 'typepad.com' in original_href and 'window.open' in onclick
+        if is_known_popup_url or is_generic_js_popup:
+            if a_tag.find('img'):
+                a_tag.unwrap()
+            elif not a_tag.get_text(strip=True):
+                a_tag.decompose()
+            return
+
+    # Rule 2: Rewrite internal links between blog posts
+    if blog_url and original_href.startswith(blog_url):
+        is_media = os.path.splitext(original_href)[1].lower() in MEDIA_LINK_EXTENSIONS
+        if not is_media:
+             path = urlparse(original_href).path
+             slug = os.path.splitext(os.path.basename(path))[0]
+             if slug:
+                 a_tag['href'] = f"/{slug}/"
+                 return
+
+    # Rule 3: Rewrite links to media files (including images wrapped in links)
+    new_filename = find_file_in_map(original_href, local_file_slug, stem_map, basename_map)
+    if new_filename:
+        # If the link just wraps an image, unwrap it.
+        if a_tag.find('img'):
+            a_tag.unwrap()
+        # Otherwise, it's a link to a file (like a PDF), so rewrite the href.
+        else:
+            a_tag['href'] = f"{WP_MEDIA_PATH}{new_filename}"
+
+def process_img_tag(img_tag, stem_map, basename_map, local_file_slug):
+    """
+    Rewrites an <img> tag's src to its new media location and converts inline
+    float styles to WordPress alignment classes.
+    """
+    new_filename = find_file_in_map(img_tag['src'], local_file_slug, stem_map, basename_map)
+    if new_filename:
+        img_tag['src'] = f"{WP_MEDIA_PATH}{new_filename}"
+
+    # Convert inline float styles to WordPress alignment classes.
+    # A single attribute lookup both checks for and fetches the style.
+    style = img_tag.get('style')
+    if style is not None:
+        style = style.lower()
+        new_classes = img_tag.get('class', [])
+        if 'float: right' in style:
+            new_classes.append('alignright')
+        elif 'float: left' in style:
+            new_classes.append('alignleft')
+        if new_classes:
+            img_tag['class'] = ' '.join(new_classes)
+            del img_tag['style']
+
 def process_content(soup_content, stem_map, basename_map, local_file_slug, blog_url, scrub_popups=True, remove_divs=True, remove_brs=True):
     """
     Cleans and rewrites the post content by processing all links and tags
-    in a structured order.
+    in a single walk over the tree.
     """
-    # --- Step 1: Remove "Editor's Note" paragraphs ---
-    editor_note_phrases = ["Back in March", "none of the images will work", "a lot of links are now broken"]
-    for p_tag in soup_content.find_all('p'):
-        p_text = p_tag.get_text()
-        if all(phrase in p_text for phrase in editor_note_phrases):
-            p_tag.decompose()
-
-    # --- Step 2: Unwrap images from bare <td> tags ---
-    for td_tag in soup_content.find_all('td'):
-        if td_tag.parent.name != 'tr':
-            td_tag.unwrap()
-
-    # --- Step 3: Remove all div tags if enabled ---
-    if remove_divs:
-        for div_tag in soup_content.find_all('div'):
-            div_tag.unwrap()
-
-    # --- New Step 4: Remove <br> tags if enabled ---
-    if remove_brs:
-        for br_tag in soup_content.find_all('br'):
-            br_tag.replace_with(' ') # Replace with a single space
-
-    # --- Step 5: Process all links (<a> tags) in one go ---
-    for a_tag in soup_content.find_all('a', href=True):
-        if not a_tag.parent:
+    # Take a snapshot of every tag up front so that unwrapping, replacing and
+    # decomposing tags during the walk doesn't disturb the iteration. The walk
+    # is in document order, so a parent is always handled before its children.
+    tags = soup_content.find_all(True)
+    # Editor's notes are removed before the walk, as a popup link around one
+    # is kept or dropped depending on what is left inside it.
+    for tag in tags:
+        if tag.name == 'p' and not tag.decomposed:
+            remove_editor_note(tag)
+    # Whether a <td> is bare depends on its parent before any <div> or <a>
+    # around it was unwrapped, so each <td>'s parent is recorded up front. Only
+    # unwrapping a bare <td> itself hands its children a new parent.
+    td_parents = {id(tag): tag.parent for tag in tags if tag.name == 'td'}
+    unwrapped_tds = set()
+    for tag in tags:
+        # Skip tags that were destroyed along with an ancestor earlier in the walk.
+        if tag.decomposed:
             continue
 
-        original_href = a_tag.get('href', '')
-        # Rule 1: Scrub JavaScript Popups
-        if scrub_popups:
-            onclick = a_tag.get('onclick', '')
-            is_known_popup_url = '.shared/image.html' in original_href or original_href.endswith('-popup')
-            is_generic_js_popup = 'typepad.com' in original_href and 'window.open' in onclick
-            if is_known_popup_url or is_generic_js_popup:
-                if a_tag.find('img'):
-                    a_tag.unwrap()
-                elif not a_tag.get_text(strip=True):
-                    a_tag.decompose()
-                continue
-
-        # Rule 2: Rewrite internal links between blog posts
-        if blog_url and original_href.startswith(blog_url):
-            is_media = any(original_href.lower().endswith(ext) for ext in ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.pdf', '.zip', '.doc', '.docx', '.mp3'])
-            if not is_media:
-                 path = urlparse(original_href).path
-                 slug = os.path.splitext(os.path.basename(path))[0]
-                 if slug:
-                     a_tag['href'] = f"/{slug}/"
-                     continue
-
-        # Rule 3: Rewrite links to media files (including images wrapped in links)
-        new_filename = find_file_in_map(original_href, local_file_slug, stem_map, basename_map)
-        if new_filename:
-            # If the link just wraps an image, unwrap it.
-            if a_tag.find('img'):
-                a_tag.unwrap()
-            # Otherwise, it's a link to a file (like a PDF), so rewrite the href.
-            else:
-                a_tag['href'] = f"{WP_MEDIA_PATH}{new_filename}"
-
-    # --- Step 6: Rewrite and clean all standalone <img> tags ---
-    for img_tag in soup_content.find_all('img', src=True):
-        new_filename = find_file_in_map(img_tag['src'], local_file_slug, stem_map, basename_map)
-        if new_filename:
-            img_tag['src'] = f"{WP_MEDIA_PATH}{new_filename}"
-
-        # Convert inline float styles to WordPress alignment classes
-        if img_tag.has_attr('style'):
-            style = img_tag['style'].lower()
-            new_classes = img_tag.get('class', [])
-            if 'float: right' in style:
-                new_classes.append('alignright')
-            elif 'float: left' in style:
-                new_classes.append('alignleft')
-            if new_classes:
-                img_tag['class'] = ' '.join(new_classes)
-                del img_tag['style']
+        name = tag.name
+        if name == 'td':
+            # Unwrap images from bare <td> tags
+            parent = td_parents[id(tag)]
+            while id(parent) in unwrapped_tds:
+                parent = td_parents[id(parent)]
+            if parent.name != 'tr':
+                unwrapped_tds.add(id(tag))
+                tag.unwrap()
+        elif name == 'div':
+            if remove_divs:
+                tag.unwrap()
+        elif name == 'br':
+            if remove_brs:
+                tag.replace_with(' ') # Replace with a single space
+        elif name == 'a':
+            if tag.get('href') is not None:
+                process_link_tag(tag, stem_map, basename_map, local_file_slug, blog_url, scrub_popups)
+        elif name == 'img':
+            if tag.get('src') is not None:
+                process_img_tag(tag, stem_map, basename_map, local_file_slug)
 
     return soup_content
 
@@ -348,8 +394,13 @@ def process_single_file(html_file, stem_map, basename_map, args):
                 tqdm.write(f"DEBUG [{local_file_slug}]: All parsing methods failed. Using current time.")
             publish_date = datetime.now()
 
-        author_tag = full_soup.find('div', class_=lambda c: c and c.startswith('entry-author-'))
-        author_name = author_tag['class'][0].replace('entry-author-', '') if author_tag else DEFAULT_AUTHOR
+        author_tag = full_soup.find('div', class_=AUTHOR_CLASS_RE)
+        if author_tag:
+            # Use the class that matched, which isn't always the first one.
+            author_class = next(c for c in author_tag['class'] if AUTHOR_CLASS_RE.match(c))
+            author_name = author_class.replace('entry-author-', '')
+        else:
+            author_name = DEFAULT_AUTHOR
 
         content_soup = process_content(
             content_div, stem_map, basename_map, local_file_slug, args.blog_url,
@@ -493,19 +544,23 @@ def main():
     all_wxr_items = []
     # --- Assemble WXR items sequentially AFTER parallel processing AND sorting ---
     for i, post_data in enumerate(processed_posts_data):
+        # Format the publish date once for each of the two formats WXR needs.
+        publish_date = post_data['publish_date']
+        pub_date_rss = publish_date.strftime('%a, %d %b %Y %H:%M:%S +0000')
+        pub_date_wp = publish_date.strftime('%Y-%m-%d %H:%M:%S')
         item = f"""
     <item>
         <title>{post_data['title_text']}</title>
         <link>{post_data['original_post_url']}</link>
-        <pubDate>{post_data['publish_date'].strftime('%a, %d %b %Y %H:%M:%S +0000')}</pubDate>
+        <pubDate>{pub_date_rss}</pubDate>
         <dc:creator><![CDATA[{post_data['author_name']}]]></dc:creator>
         <guid isPermaLink="false">{post_data['post_name']}</guid>
         <description></description>
         <content:encoded><![CDATA[{post_data['content_html']}]]></content:encoded>
         <excerpt:encoded><![CDATA[]]></excerpt:encoded>
         <wp:post_id>{i + 1}</wp:post_id>
-        <wp:post_date><![CDATA[{post_data['publish_date'].strftime('%Y-%m-%d %H:%M:%S')}]]></wp:post_date>
-        <wp:post_date_gmt><![CDATA[{post_data['publish_date'].strftime('%Y-%m-%d %H:%M:%S')}]]></wp:post_date_gmt>
+        <wp:post_date><![CDATA[{pub_date_wp}]]></wp:post_date>
+        <wp:post_date_gmt><![CDATA[{pub_date_wp}]]></wp:post_date_gmt>
         <wp:comment_status><![CDATA[closed]]></wp:comment_status>
         <wp:ping_status><![CDATA[closed]]></wp:ping_status>
         <wp:post_name><![CDATA[{post_data['post_name']}]]></wp:post_name>